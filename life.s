@@ -1,11 +1,9 @@
-        org $40
-
-ptr:    dat 2
-src:    dat 2
-dest:   dat 2
-row:    dat 1
-col:    dat 1
-gen:    dat 1
+        zvar ptr,2
+        zvar src,2
+        zvar dest,2
+        zvar row
+        zvar col
+        zvar gen
 
         org $800
 
@@ -1,5 +1,7 @@
+import argparse
 import itertools
 import json
+import os
 import re
 import sys
 
@@ -12,15 +14,59 @@ class Instruction:
         self.opcode = opcode
         self.operand = operand
     def bytes(self):
-        return [self.opcode] + self.operand()
+        if self.operand is None:
+            return [self.opcode]
+        return [self.opcode] + self.operand.bytes()
+    def relocate(self):
+        if self.operand is None:
+            return [self.opcode], []
+        data, relocs = self.operand.relocate()
+        return [self.opcode] + data, relocs
     def size(self):
         return self._size
 
+class Operand:
+    """Instruction operand, resolved when the bytes are requested.
+
+    A value that depends on a relocatable segment or an imported symbol
+    cannot be resolved by the assembler and becomes a relocation record.
+    So does a branch from a relocatable segment to an absolute address,
+    whose record has neither a segment nor a symbol.
+    """
+    def __init__(self, kind, expr):
+        self.kind = kind
+        self.expr = expr
+        self.section = emitter.section
+        self.pc = emitter.get_pc()
+    def resolvable(self, base):
+        if self.kind == "rel":
+            return base == self.section.base()
+        return base is None
+    def bytes(self):
+        base, value = evaluate_reloc(self.expr)
+        if not self.resolvable(base):
+            raise Error("Relocatable reference requires linking: {}".format(self.expr))
+        return encode(self.kind, value, self.pc)
+    def relocate(self):
+        base, value = evaluate_reloc(self.expr)
+        if self.resolvable(base):
+            return encode(self.kind, value, self.pc), []
+        reloc = {
+            "offset": self.pc - self.section.start() + 1,
+            "kind": self.kind,
+            "addend": value,
+        }
+        if base is not None:
+            reloc[base[0]] = base[1]
+        return [0] * (2 if self.kind == "word" else 1), [reloc]
+
 class Data:
     def __init__(self, data):
         self.data = list(map(parse, "".join(map(chr, data)).split(",")))
     def bytes(self):
         return self.data
+    def relocate(self):
+        return self.data, []
     def size(self):
         return len(self.data)
 
@@ -29,32 +75,138 @@ class DataW:
         self.data = list(itertools.chain(*[[x & 0xff, x >> 8] for x in map(parse, "".join(map(chr, data)).split(","))]))
     def bytes(self):
         return self.data
+    def relocate(self):
+        return self.data, []
     def size(self):
         return len(self.data)
 
+class Space:
+    def __init__(self, size):
+        self.data = [0] * size
+    def bytes(self):
+        return self.data
+    def relocate(self):
+        return self.data, []
+    def size(self):
+        return len(self.data)
+
+class Section:
+    def __init__(self, name, address):
+        self.name = name
+        self.address = address
+        self.insns = []
+    def base(self):
+        if self.name is None:
+            return None
+        return ("segment", self.name)
+    def start(self):
+        if self.address is None:
+            return 0
+        return self.address
+    def size(self):
+        return sum(x.size() for x in self.insns)
+
 class Emitter:
     def __init__(self):
         self.pc = 0
-        self.ranges = []
+        self.section = Section(None, 0)
+        self.sections = []
+        self.reserved = []
     def dump(self):
-        for r in self.ranges:
-            pc = r[0]
-            for ins in r[1]:
-                print("{:x}- {}".format(pc, " ".join("{:02x}".format(x) for x in ins.bytes())))
+        for s in self.sections:
+            pc = s.start()
+            for ins in s.insns:
+                print("{:x}- {}".format(pc, " ".join("{:02x}".format(x) for x in ins.relocate()[0])))
                 pc += ins.size()
     def emit(self, ins):
-        self.ranges[-1][1].append(ins)
+        if self.section not in self.sections:
+            self.sections.append(self.section)
+        self.section.insns.append(ins)
         self.pc += ins.size()
     def getbytes(self):
-        return [(address, list(itertools.chain(*[x.bytes() for x in insns]))) for address, insns in self.ranges if insns]
+        r = []
+        for s in self.sections:
+            if s.address is None:
+                raise Error("Relocatable segment requires linking: {}".format(s.name))
+            if s.insns:
+                r.append((s.address, list(itertools.chain(*[x.bytes() for x in s.insns]))))
+        return r
+    def size(self):
+        return sum(s.size() for s in self.sections)
+    def getobject(self):
+        if zero_page.vars:
+            raise Error("ZVAR is not supported in relocatable objects: {}".format(", ".join(sorted(zero_page.vars))))
+        segments = []
+        for s in self.sections:
+            data = []
+            relocs = []
+            for ins in s.insns:
+                d, rs = ins.relocate()
+                data += d
+                relocs += rs
+            segments.append({"name": s.name, "org": s.address, "bytes": data, "relocs": relocs})
+        exports = {}
+        for name in sorted(exported):
+            if name not in symbols:
+                raise Error("Unknown symbol: {}".format(name))
+            exports[name] = [symbol_segments.get(name), symbols[name]]
+        return {"segments": segments, "exports": exports, "imports": sorted(imported)}
     def get_pc(self):
         return self.pc
+    def in_segment(self):
+        return self.section.name is not None
     def set_org(self, pc):
         self.pc = pc
-        self.ranges.append((pc, []))
+        self.section = Section(None, pc)
+    def set_segment(self, name):
+        s = find(lambda x: x.name == name, self.sections)
+        if s is None:
+            s = Section(name, None)
+        self.section = s
+        self.pc = s.size()
+
+class ZeroPage:
+    """Assigns ZVAR variables to free zero page, spilling to absolute memory."""
+    def __init__(self, start=0x40, end=0x100, spill=0x300):
+        if not 0 <= start <= end <= 0x100:
+            raise Error("Zero page range out of range: {:x}-{:x}".format(start, end - 1))
+        self.start = start
+        self.end = end
+        self.spill_start = spill
+        self.next = start
+        self.spill = spill
+        self.vars = {}
+        self.pending = {}
+    def allocate(self, name, size, weight=0):
+        if self.next + size <= self.end:
+            address = self.next
+            self.next += size
+        else:
+            address = self.spill
+            self.spill += size
+        self.vars[name] = (address, size, weight)
+        return address
+    def spilled(self, name):
+        return not self.start <= self.vars[name][0] < self.end
+    def dump(self):
+        for name, (address, size, weight) in sorted(self.vars.items(), key=lambda x: x[1][0]):
+            print("{:04x} {:<12} {:3} {:8}{}".format(address, name, size, weight, " spilled" if self.spilled(name) else ""))
 
 emitter = Emitter()
+zero_page = ZeroPage()
 symbols = {}
+symbol_segments = {}
+exported = set()
+imported = set()
+
+def reset():
+    global emitter, zero_page
+    emitter = Emitter()
+    zero_page = ZeroPage(zero_page.start, zero_page.end, zero_page.spill_start)
+    symbols.clear()
+    symbol_segments.clear()
+    exported.clear()
+    imported.clear()
 
 def find(f, seq):
     """Return first item in sequence where f(item) == True."""
@@ -105,7 +257,12 @@ def tokenise(s):
         else:
             i += 1
 
-def evaluate(s):
+def evaluate_reloc(s):
+    """Evaluate s, returning (base, value).
+
+    base is None for an absolute value, ("segment", name) for an offset
+    into a relocatable segment, or ("symbol", name) for an imported symbol.
+    """
     offset = 0
     m = re.search(r"[+-]\s*(\d+)$", s)
     if m is not None:
@@ -113,12 +270,23 @@ def evaluate(s):
         s = s[:m.start(0)]
     val = parse(s)
     if val is not None:
-        return val + offset
+        return None, val + offset
     val = symbols.get(s)
     if val is not None:
-        return val + offset
+        segment = symbol_segments.get(s)
+        if segment is not None:
+            return ("segment", segment), val + offset
+        return None, val + offset
+    if s in imported:
+        return ("symbol", s), offset
     raise Error("Unknown symbol: {}".format(s))
 
+def evaluate(s):
+    base, val = evaluate_reloc(s)
+    if base is not None:
+        raise Error("Relocatable value not allowed: {}".format(s))
+    return val
+
 def operand_byte(x):
     if 0 <= x <= 0xff:
         return [x]
@@ -139,22 +307,37 @@ def operand_word(x):
     else:
         raise Error("Address value out of range: {}".format(x))
 
+def encode(kind, value, pc):
+    """Encode the operand value of the instruction at pc."""
+    if kind == "byte":
+        return operand_byte(value)
+    elif kind == "lo":
+        return operand_byte(value & 0xff)
+    elif kind == "hi":
+        return operand_byte(value >> 8)
+    elif kind == "word":
+        return operand_word(value)
+    elif kind == "rel":
+        return operand_sbyte(value - (pc + 2))
+    else:
+        raise Error("Unknown operand kind: {}".format(kind))
+
 def absolute_mode(operand):
-    return 3, lambda: operand_word(evaluate(operand))
+    return 3, Operand("word", operand)
 
 def absolute_x_mode(operand):
     m = re.match(r"(.+),X$", strip(operand), re.IGNORECASE)
     if m is None:
         return None
     s = m.group(1)
-    return 3, lambda: operand_word(evaluate(s))
+    return 3, Operand("word", s)
 
 def absolute_y_mode(operand):
     m = re.match(r"(.+),Y$", strip(operand), re.IGNORECASE)
     if m is None:
         return None
     s = m.group(1)
-    return 3, lambda: operand_word(evaluate(s))
+    return 3, Operand("word", s)
 
 def immediate_mode(operand):
     m = re.match(r"#(([<>])?(.+))$", strip(operand))
@@ -164,40 +347,39 @@ def immediate_mode(operand):
     hilo = m.group(2)
     if hilo:
         if hilo == ">":
-            return 2, lambda: operand_byte(evaluate(s) & 0xff)
+            return 2, Operand("lo", s)
         elif hilo == "<":
-            return 2, lambda: operand_byte(evaluate(s) >> 8)
+            return 2, Operand("hi", s)
     else:
-        return 2, lambda: operand_byte(evaluate(s))
+        return 2, Operand("byte", s)
 
 def indirect_mode(operand):
     m = re.match(r"\((.+)\)$", strip(operand))
     if m is None:
         return None
     s = m.group(1)
-    return 3, lambda: operand_word(evaluate(s))
+    return 3, Operand("word", s)
 
 def indirect_x_mode(operand):
     m = re.match(r"\((.+),X\)$", strip(operand), re.IGNORECASE)
     if m is None:
         return None
     s = m.group(1)
-    return 2, lambda: operand_byte(evaluate(s))
+    return 2, Operand("byte", s)
 
 def indirect_y_mode(operand):
     m = re.match(r"\((.+)\),Y$", strip(operand), re.IGNORECASE)
     if m is None:
         return None
     s = m.group(1)
-    return 2, lambda: operand_byte(evaluate(s))
+    return 2, Operand("byte", s)
 
 def relative_mode(operand):
     m = re.match(r"(.+)$", strip(operand))
     if m is None:
         return None
     s = m.group(1)
-    pc = emitter.get_pc()
-    return 2, lambda: operand_sbyte(evaluate(s) - (pc + 2))
+    return 2, Operand("rel", s)
 
 def zero_page_mode(operand):
     m = re.match(r"(.+)$", strip(operand))
@@ -206,7 +388,7 @@ def zero_page_mode(operand):
     s = m.group(1)
     try:
         if 0 <= evaluate(s) <= 0xff:
-            return 2, lambda: operand_byte(evaluate(s))
+            return 2, Operand("byte", s)
     except Error:
         pass
     return None
@@ -218,7 +400,7 @@ def zero_page_x_mode(operand):
     s = m.group(1)
     try:
         if 0 <= evaluate(s) <= 0xff:
-            return 2, lambda: operand_byte(evaluate(s))
+            return 2, Operand("byte", s)
     except Error:
         pass
     return None
@@ -228,7 +410,7 @@ def zero_page_y_mode(operand):
     if m is None:
         return None
     s = m.group(1)
-    return 2, lambda: operand_byte(evaluate(s))
+    return 2, Operand("byte", s)
 
 OpcodeParseOrder = (
     indirect_x_mode,    # (zzz,X)
@@ -406,9 +588,26 @@ def op_DW(operand):
     return DataW(list(map(ord, operand)))
 
 def op_DAT(operand):
+    if emitter.in_segment():
+        return Space(parse(operand))
+    emitter.reserved.append((emitter.get_pc(), parse(operand)))
     emitter.set_org(emitter.get_pc() + parse(operand))
     return None
 
+def op_ENTRY(operand):
+    return None
+
+def op_EXPORT(operand):
+    exported.update(operand.split(","))
+    return None
+
+def op_IMPORT(operand):
+    for name in operand.split(","):
+        if name in symbols:
+            raise Error("Imported symbol is defined locally: {}".format(name))
+        imported.add(name)
+    return None
+
 def op_ORG(operand):
     emitter.set_org(parse(operand))
     return None
@@ -420,6 +619,36 @@ def op_SET(operand):
     symbols[m.group(1)] = parse(m.group(2))
     return None
 
+def zvar_operand(operand):
+    m = re.match(r"([A-Za-z_]\w*)(,(.+))?$", operand)
+    if m is None:
+        raise Error("Incorrect syntax: " + operand)
+    size = 1
+    if m.group(3) is not None:
+        size = parse(m.group(3))
+        if size is None or size < 1:
+            raise Error("Incorrect size: " + operand)
+    return m.group(1), size
+
+def define_zvar(name, address):
+    if name in symbols or name in imported:
+        raise Error("Duplicate symbol: {}".format(name))
+    symbols[name] = address
+
+def op_ZVAR(operand):
+    name, size = zvar_operand(operand)
+    if name in zero_page.pending:
+        del zero_page.pending[name]
+    else:
+        define_zvar(name, zero_page.allocate(name, size))
+    return None
+
+def op_SEG(operand):
+    if not operand:
+        raise Error("Segment name expected")
+    emitter.set_segment(operand)
+    return None
+
 def opcode(mnemonic, operand):
     modes = Opcodes.get(mnemonic.upper())
     if modes is None:
@@ -433,7 +662,7 @@ def opcode(mnemonic, operand):
             if amode is None:
                 if operand:
                     return None
-                return Instruction(size, op, lambda: [])
+                return Instruction(size, op, None)
             if operand:
                 r = amode(operand)
                 if r is not None:
@@ -441,23 +670,20 @@ def opcode(mnemonic, operand):
                     return Instruction(size, op, opfunc)
     return None
 
-def assemble_instruction(s):
+def split_line(s):
+    """Split a source line into (label, mnemonic, operand); absent parts are None."""
     a = list(tokenise(s))
     comment = find(lambda x: x[1][0] is WORD and x[1][1].startswith(";"), enumerate(a))
     if comment:
         a = a[:comment[0]]
     it = iter(a)
     tok = next(it, None)
-    if tok is None:
-        return None
-    if tok[0] is WORD and tok[1].endswith(":"):
+    label = None
+    if tok is not None and tok[0] is WORD and tok[1].endswith(":"):
         label = tok[1][:-1]
-        if label in symbols:
-            raise Error("Duplicate symbol: {}".format(label))
-        symbols[label] = emitter.get_pc()
         tok = next(it, None)
     if tok is None:
-        return None
+        return label, None, None
     if tok[0] is not WORD:
         raise Error("Mnemonic expected: {}".format(tok))
     mnemonic = tok[1]
@@ -468,6 +694,18 @@ def assemble_instruction(s):
         tok = next(it, None)
     if tok is not None:
         raise Error("Extra input on line: {}".format(s))
+    return label, mnemonic, operand
+
+def assemble_instruction(s):
+    label, mnemonic, operand = split_line(s)
+    if label is not None:
+        if label in symbols or label in imported:
+            raise Error("Duplicate symbol: {}".format(label))
+        symbols[label] = emitter.get_pc()
+        if emitter.in_segment():
+            symbol_segments[label] = emitter.section.name
+    if mnemonic is None:
+        return None
     op = globals().get("op_" + mnemonic.upper())
     if op is not None:
         return op(operand)
@@ -478,18 +716,318 @@ def assemble_instruction(s):
             raise Error("Unknown opcode: {}".format(mnemonic))
         return ins
 
-def assemble(infile, outfile):
-    with open(infile) as inf:
-        for s in inf:
-            ins = assemble_instruction(s)
-            if ins is not None:
-                emitter.emit(ins)
+Directives = {"ORG", "SEG", "SET", "ZVAR", "IMPORT", "EXPORT", "ENTRY"}
+
+class Block:
+    def __init__(self, label):
+        self.label = label
+        self.lines = []
+        self.refs = set()
+        self.code = False
+        self.empty = True
+        self.falls = True
+
+def reachable_lines(lines):
+    """Return lines without the labelled blocks that cannot be reached.
+
+    A block runs from a label to the next label, ORG or SEG. It is reached
+    from an entry point (the first code, ENTRY and EXPORT labels), by an
+    operand reference, or by falling through from the block that ends
+    where it starts, in the same segment. Unlabelled code and data, and
+    directive lines, are always kept. The lines are assembled to find
+    where each block starts and ends.
+    """
+    reset()
+    places = assemble_lines(lines)
+    blocks = [Block(None)]
+    keep = []
+    entries = []
+    exports = []
+    for i, s in enumerate(lines):
+        label, mnemonic, operand = split_line(s)
+        if label is not None:
+            blocks.append(Block(label))
+        block = blocks[-1]
+        m = mnemonic.upper() if mnemonic is not None else None
+        if m in Directives:
+            keep.append(i)
+            if m == "ENTRY":
+                entries.extend(operand.split(","))
+            elif m == "EXPORT":
+                exports.extend(operand.split(","))
+            elif m in ("ORG", "SEG"):
+                blocks.append(Block(None))
+            continue
+        block.lines.append(i)
+        if m is None:
+            continue
+        block.empty = False
+        if m in Opcodes:
+            block.refs.update(operand_symbols(operand))
+            block.falls = m not in ("JMP", "RTS", "RTI")
+            block.code = True
+        else:
+            block.falls = False
+    starts = {}
+    for b in blocks:
+        if b.lines:
+            starts.setdefault(places[b.lines[0]], []).append(b)
+    def successor(b):
+        following = [x for x in starts.get(places[b.lines[-1] + 1], []) if x is not b]
+        later = [x for x in following if blocks.index(x) > blocks.index(b)]
+        return (later + following + [None])[0]
+    labels = {b.label: b for b in blocks if b.label is not None}
+    for name in entries:
+        if name not in labels:
+            raise Error("Unknown symbol: {}".format(name))
+    todo = [labels[x] for x in entries + exports if x in labels]
+    todo.extend(b for b in blocks if b.label is None and not b.empty)
+    todo.extend(itertools.islice((b for b in blocks if b.code), 1))
+    reached = set()
+    while todo:
+        b = todo.pop()
+        if b in reached:
+            continue
+        reached.add(b)
+        todo.extend(labels[x] for x in b.refs if x in labels)
+        if b.falls and b.lines and successor(b) is not None:
+            todo.append(successor(b))
+    for b in reached:
+        keep.extend(b.lines)
+    return [lines[i] for i in sorted(keep)]
+
+def assemble_stripped(lines):
+    """Assemble lines with unreachable blocks removed, returning the bytes saved."""
+    lines = list(lines)
+    kept = reachable_lines(lines)
+    before = emitter.size()
+    reset()
+    assemble_lines(kept)
+    return before - emitter.size()
+
+def coalesce(ranges):
+    """Sort ranges by address, merging adjacent ones. Overlaps are an error."""
+    r = []
+    for address, data in sorted(ranges, key=lambda x: x[0]):
+        if not data:
+            continue
+        if r:
+            last, lastdata = r[-1]
+            end = last + len(lastdata)
+            if address < end:
+                raise Error("Overlapping ranges: {:x}-{:x} and {:x}-{:x}".format(last, end - 1, address, address + len(data) - 1))
+            if address == end:
+                lastdata.extend(data)
+                continue
+        r.append((address, bytearray(data)))
+    return r
+
+def make_image(ranges, base=0, size=None, fill=0):
+    """Return a flat image of size bytes starting at base, with gaps filled."""
+    ranges = coalesce(ranges)
+    if size is None:
+        size = max([address + len(data) for address, data in ranges] + [base]) - base
+    image = bytearray([fill]) * size
+    for address, data in ranges:
+        if address < base or address + len(data) > base + size:
+            raise Error("Range {:x}-{:x} outside image {:x}-{:x}".format(address, address + len(data) - 1, base, base + size - 1))
+        image[address - base:address - base + len(data)] = data
+    return image
+
+def image_delta(old, new, base=0):
+    """Return the ranges where image new differs from image old."""
+    if len(new) < len(old):
+        raise Error("Image is {} bytes shorter than the previous one".format(len(old) - len(new)))
+    r = []
+    i = 0
+    while i < len(new):
+        if i < len(old) and old[i] == new[i]:
+            i += 1
+            continue
+        j = i
+        while j < len(new) and (j >= len(old) or old[j] != new[j]):
+            j += 1
+        r.append((base + i, list(new[i:j])))
+        i = j
+    return r
+
+def write_image(outfile, image, base=0, previous=None):
+    if previous is None:
+        with open(outfile, "wb") as outf:
+            outf.write(image)
+    else:
+        if os.path.exists(outfile) and os.path.samefile(outfile, previous):
+            raise Error("Delta output would overwrite the previous image: {}".format(previous))
+        with open(previous, "rb") as f:
+            old = f.read()
         with open(outfile, "w") as outf:
-            print(json.dumps(emitter.getbytes()), file=outf)
+            print(json.dumps(image_delta(old, image, base)), file=outf)
+
+def operand_symbols(operand):
+    """Return the symbol names referenced by an instruction operand."""
+    return re.findall(r"(?<![\w$])[A-Za-z_]\w*", re.sub(r",[XY]\)?$", "", strip(operand), flags=re.IGNORECASE))
+
+def is_branch(mnemonic):
+    return mnemonic.upper() == "JMP" or any(amode is relative_mode for op, amode in Opcodes[mnemonic.upper()])
+
+def allocate_zvars(lines):
+    """Assign the ZVAR declarations in lines, most referenced first.
+
+    A reference counts 10**depth, where depth is the number of loops
+    (backward branches or jumps) around it. Variables used as indirect
+    pointers must be in zero page and are assigned before all others.
+    """
+    decls = []
+    labels = {}
+    loops = []
+    refs = []
+    for i, s in enumerate(lines):
+        label, mnemonic, operand = split_line(s)
+        if label is not None:
+            labels[label] = i
+        if mnemonic is None:
+            continue
+        if mnemonic.upper() == "ZVAR":
+            decls.append(zvar_operand(operand))
+        elif mnemonic.upper() in Opcodes:
+            target = labels.get(strip(operand))
+            if target is not None and is_branch(mnemonic):
+                loops.append((target, i))
+            refs.append((i, strip(operand)))
+    weights = {}
+    for name, size in decls:
+        if name in weights:
+            raise Error("Duplicate symbol: {}".format(name))
+        weights[name] = 0
+    required = set()
+    for i, operand in refs:
+        depth = len([1 for start, end in loops if start <= i <= end])
+        indirect = re.match(r"\(.*(,X\)|\),Y)$", operand, re.IGNORECASE) is not None
+        for name in operand_symbols(operand):
+            if name in weights:
+                weights[name] += 10 ** depth
+                if indirect:
+                    required.add(name)
+    for name, size in sorted(decls, key=lambda x: (x[0] not in required, -weights[x[0]])):
+        define_zvar(name, zero_page.allocate(name, size, weights[name]))
+        if name in required and zero_page.spilled(name):
+            raise Error("No zero page left for indirect pointer: {}".format(name))
+        zero_page.pending[name] = True
+
+def check_zvars():
+    """Check that no ZVAR shares memory with emitted code, data or DAT space."""
+    ranges = [(address, [0] * size) for address, size, weight in zero_page.vars.values()]
+    if not ranges:
+        return
+    ranges += [(s.address, [0] * s.size()) for s in emitter.sections if s.address is not None]
+    ranges += [(address, [0] * size) for address, size in emitter.reserved]
+    try:
+        coalesce(ranges)
+    except Error as e:
+        raise Error("ZVAR overlaps emitted code or data: {}".format(e.args[0]))
+
+def assemble_lines(lines):
+    """Assemble lines, returning the (segment, pc) before each line and at the end."""
+    lines = list(lines)
+    allocate_zvars(lines)
+    places = []
+    for s in lines:
+        places.append((emitter.section.name, emitter.get_pc()))
+        ins = assemble_instruction(s)
+        if ins is not None:
+            emitter.emit(ins)
+    places.append((emitter.section.name, emitter.get_pc()))
+    check_zvars()
+    return places
+
+def assemble(infile, outfile, relocatable=False):
+    with open(infile) as inf:
+        assemble_lines(inf)
+    write_object(outfile, relocatable)
+
+def write_object(outfile, relocatable=False):
+    if relocatable:
+        output = emitter.getobject()
+    else:
+        output = emitter.getbytes()
+    with open(outfile, "w") as outf:
+        print(json.dumps(output), file=outf)
+
+def number(s):
+    val = parse(s)
+    if val is None:
+        raise argparse.ArgumentTypeError("expected a number: {}".format(s))
+    return val
+
+def byte(s):
+    val = number(s)
+    if not 0 <= val <= 0xff:
+        raise argparse.ArgumentTypeError("expected a byte: {}".format(s))
+    return val
+
+def add_image_arguments(parser):
+    parser.add_argument("--base", type=number, help="image start address (default: 0)")
+    parser.add_argument("--size", type=number, help="image size (default: up to the last byte)")
+    parser.add_argument("--fill", type=byte, help="byte used for gaps (default: 0)")
+    parser.add_argument("--delta", metavar="PREVIOUS",
+                        help="write only the ranges that differ from image PREVIOUS (default: input with .delta)")
+
+def check_image_arguments(parser, args):
+    if not args.image:
+        for name in ("base", "size", "fill", "delta"):
+            if getattr(args, name) is not None:
+                parser.error("--{} requires -i".format(name))
+
+def output_image(ranges, args, stem):
+    base = args.base or 0
+    image = make_image(ranges, base, args.size, args.fill or 0)
+    if args.delta is not None and args.size is None:
+        image.extend([args.fill or 0] * (os.path.getsize(args.delta) - len(image)))
+    if args.delta is None:
+        outfile = args.output or stem + ".ram"
+    else:
+        outfile = args.output or stem + ".delta"
+    write_image(outfile, image, base, args.delta)
+
+def address_range(s):
+    start, sep, end = s.partition("-")
+    if not sep or parse(start) is None or parse(end) is None:
+        raise argparse.ArgumentTypeError("expected START-END: {}".format(s))
+    return parse(start), parse(end) + 1
 
 def main():
-    fn = sys.argv[1]
-    assemble(fn, fn[:-2] + ".o")
+    global zero_page
+    parser = argparse.ArgumentParser(description="6502 assembler")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("-r", "--relocatable", action="store_true",
+                      help="write a relocatable object for pyld.py")
+    mode.add_argument("-i", "--image", action="store_true",
+                      help="write a flat memory image (default: input with .ram)")
+    add_image_arguments(parser)
+    parser.add_argument("--zp", type=address_range, default=(0x40, 0x100), metavar="START-END",
+                        help="zero page free for ZVAR (default: $40-$ff)")
+    parser.add_argument("--zp-spill", type=number, default=0x300, metavar="ADDRESS",
+                        help="where ZVARs that do not fit in zero page go (default: $300)")
+    parser.add_argument("--strip", action="store_true",
+                        help="remove blocks that cannot be reached from an entry point")
+    parser.add_argument("-o", "--output", help="output file (default: input with .o)")
+    parser.add_argument("file")
+    args = parser.parse_args()
+    check_image_arguments(parser, args)
+    if args.zp[1] > 0x100:
+        parser.error("--zp must be within zero page: {:x}-{:x}".format(args.zp[0], args.zp[1] - 1))
+    zero_page = ZeroPage(args.zp[0], args.zp[1], args.zp_spill)
+    with open(args.file) as inf:
+        lines = list(inf)
+    if args.strip:
+        print("Stripped {} bytes".format(assemble_stripped(lines)))
+    else:
+        assemble_lines(lines)
+    if args.image:
+        output_image(emitter.getbytes(), args, args.file[:-2])
+    else:
+        write_object(args.output or args.file[:-2] + ".o", args.relocatable)
+    zero_page.dump()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,108 @@
+import argparse
+import json
+
+import pyas
+
+class Error(BaseException):
+    pass
+
+def place(objects, bases):
+    """Assign an address to each relocatable segment of each object.
+
+    Pieces of the same segment from different objects are laid out one
+    after another, in the order the objects are given. A segment without
+    an entry in bases follows the previously placed segment.
+    """
+    names = []
+    for obj in objects:
+        for seg in obj["segments"]:
+            if seg["name"] is not None and seg["name"] not in names:
+                names.append(seg["name"])
+    addresses = [{} for obj in objects]
+    pc = 0
+    for name in names:
+        pc = bases.get(name, pc)
+        for obj, addrs in zip(objects, addresses):
+            for seg in obj["segments"]:
+                if seg["name"] == name:
+                    addrs[name] = pc
+                    pc += len(seg["bytes"])
+    return addresses
+
+def resolve_exports(objects, addresses):
+    exports = {}
+    for obj, addrs in zip(objects, addresses):
+        for name, (segment, value) in obj["exports"].items():
+            if name in exports:
+                raise Error("Duplicate symbol: {}".format(name))
+            if segment is not None:
+                value += addrs[segment]
+            exports[name] = value
+    return exports
+
+def link(objects, bases=None):
+    """Link relocatable objects, returning sorted, merged (address, bytes) ranges."""
+    addresses = place(objects, bases or {})
+    exports = resolve_exports(objects, addresses)
+    ranges = []
+    for obj, addrs in zip(objects, addresses):
+        for name in obj["imports"]:
+            if name not in exports:
+                raise Error("Unresolved symbol: {}".format(name))
+        for seg in obj["segments"]:
+            if seg["name"] is None:
+                address = seg["org"]
+            else:
+                address = addrs[seg["name"]]
+            data = list(seg["bytes"])
+            for reloc in seg["relocs"]:
+                if "segment" in reloc:
+                    value = addrs[reloc["segment"]] + reloc["addend"]
+                elif "symbol" in reloc:
+                    value = exports[reloc["symbol"]] + reloc["addend"]
+                else:
+                    value = reloc["addend"]
+                offset = reloc["offset"]
+                try:
+                    patch = pyas.encode(reloc["kind"], value, address + offset - 1)
+                except pyas.Error as e:
+                    raise Error("{} at {:x}".format(e.args[0], address + offset - 1))
+                data[offset:offset+len(patch)] = patch
+            if data:
+                ranges.append((address, data))
+    try:
+        ranges = pyas.coalesce(ranges)
+    except pyas.Error as e:
+        raise Error(e.args[0])
+    return [(address, list(data)) for address, data in ranges]
+
+def parse_base(s):
+    name, sep, address = s.partition("=")
+    if not sep or pyas.parse(address) is None:
+        raise argparse.ArgumentTypeError("expected NAME=ADDRESS: {}".format(s))
+    return name, pyas.parse(address)
+
+def main():
+    parser = argparse.ArgumentParser(description="Linker for pyas relocatable objects")
+    parser.add_argument("-i", "--image", action="store_true",
+                        help="write a flat memory image")
+    pyas.add_image_arguments(parser)
+    parser.add_argument("-o", "--output", required=True, help="output file")
+    parser.add_argument("-s", "--segment", type=parse_base, action="append", default=[],
+                        metavar="NAME=ADDRESS", help="base address of a segment")
+    parser.add_argument("objects", nargs="+")
+    args = parser.parse_args()
+    pyas.check_image_arguments(parser, args)
+    objects = []
+    for fn in args.objects:
+        with open(fn) as f:
+            objects.append(json.load(f))
+    ranges = link(objects, dict(args.segment))
+    if args.image:
+        pyas.output_image(ranges, args, None)
+    else:
+        with open(args.output, "w") as outf:
+            print(json.dumps(ranges), file=outf)
+
+if __name__ == "__main__":
+    main()
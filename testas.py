@@ -67,5 +67,110 @@ class TestData(unittest.TestCase):
         #self.assertEqual(asm("db \"ABC\""), [0xC1, 0xC2, 0xC3])
         self.assertEqual(asm("dw 1,2,3,4000"), [1, 0, 2, 0, 3, 0, 0xa0, 0x0f])
 
+class TestZvar(unittest.TestCase):
+    def setUp(self):
+        pyas.reset()
+        pyas.zero_page = pyas.ZeroPage(0x40, 0x43, 0x300)
+    def tearDown(self):
+        pyas.zero_page = pyas.ZeroPage()
+        pyas.reset()
+    def test_declare(self):
+        pyas.assemble_instruction("zvar a")
+        pyas.assemble_instruction("zvar b,2")
+        pyas.assemble_instruction("zvar c")
+        self.assertEqual([pyas.symbols[x] for x in "abc"], [0x40, 0x41, 0x300])
+    def test_most_used_first(self):
+        pyas.assemble_lines([
+            "zvar cold,2",
+            "zvar hot,2",
+            "org $800",
+            "lda cold",
+            "loop: lda hot",
+            "sta hot+1",
+            "bne loop",
+        ])
+        self.assertEqual(pyas.symbols["hot"], 0x40)
+        self.assertEqual(pyas.symbols["cold"], 0x300)
+        self.assertEqual(pyas.emitter.getbytes(), [(0x800, [0xad, 0x00, 0x03, 0xa5, 0x40, 0x85, 0x41, 0xd0, 0xfa])])
+    def test_indirect_pointer_first(self):
+        pyas.assemble_lines(["zvar n,2", "zvar p,2", "lda n", "lda n", "lda (p),y"])
+        self.assertEqual(pyas.symbols["p"], 0x40)
+    def test_duplicate(self):
+        with self.assertRaises(pyas.Error):
+            pyas.assemble_lines(["zvar a", "zvar a"])
+    def test_spill_overlaps_code(self):
+        with self.assertRaises(pyas.Error):
+            pyas.assemble_lines(["zvar a,2", "zvar b,2", "org $300", "lda b", "sta a"])
+    def test_spill_overlaps_dat(self):
+        with self.assertRaises(pyas.Error):
+            pyas.assemble_lines(["zvar a,2", "zvar b,2", "org $300", "buf: dat 4", "org $800", "lda a", "lda b"])
+    def test_zero_page_range(self):
+        with self.assertRaises(pyas.Error):
+            pyas.ZeroPage(0x40, 0x101)
+    def test_relocatable(self):
+        pyas.assemble_lines(["zvar x", "seg code", "sta x"])
+        with self.assertRaises(pyas.Error):
+            pyas.emitter.getobject()
+
+class TestStrip(unittest.TestCase):
+    def setUp(self):
+        pyas.reset()
+    def test_unreferenced(self):
+        lines = [
+            "org $800",
+            "jsr used",
+            "loop: jmp loop",
+            "unused: lda table",
+            "rts",
+            "used: lda #1",
+            "more: rts",
+            "table: db 1,2,3",
+        ]
+        self.assertEqual(pyas.reachable_lines(lines), ["org $800", "jsr used", "loop: jmp loop", "used: lda #1", "more: rts"])
+        self.assertEqual(pyas.assemble_stripped(lines), 7)
+        self.assertEqual(pyas.emitter.getbytes(), [(0x800, [0x20, 0x06, 0x08, 0x4c, 0x03, 0x08, 0xa9, 0x01, 0x60])])
+    def test_entry(self):
+        lines = ["seg code", "export f", "entry g", "f: rts", "g: rts", "h: rts"]
+        self.assertEqual(pyas.reachable_lines(lines), ["seg code", "export f", "entry g", "f: rts", "g: rts"])
+    def test_entry_keeps_first_code(self):
+        lines = ["org $800", "main: jsr f", "jmp main", "f: rts", "entry irq", "irq: rti", "dead: rts"]
+        self.assertEqual(pyas.reachable_lines(lines), lines[:-1])
+    def test_no_fall_through_org(self):
+        lines = ["org $800", "nop", "org $900", "x: nop"]
+        self.assertEqual(pyas.reachable_lines(lines), ["org $800", "nop", "org $900"])
+    def test_fall_through_resumed_segment(self):
+        lines = ["seg code", "export a", "a: lda d", "seg data", "d: db 1", "seg code", "b: rts", "c: rts"]
+        self.assertEqual(pyas.reachable_lines(lines), lines[:-1])
+    def test_fall_through_contiguous_org(self):
+        lines = ["org $800", "main: lda #1", "org $802", "b: rts", "c: rts"]
+        self.assertEqual(pyas.reachable_lines(lines), lines[:-1])
+    def test_unlabelled_after_org(self):
+        lines = ["org $800", "jmp $900", "org $900", "lda #1", "rts", "y: rts"]
+        self.assertEqual(pyas.reachable_lines(lines), ["org $800", "jmp $900", "org $900", "lda #1", "rts"])
+    def test_unknown_entry(self):
+        with self.assertRaises(pyas.Error):
+            pyas.reachable_lines(["entry nowhere", "nop"])
+
+class TestImage(unittest.TestCase):
+    def test_coalesce(self):
+        self.assertEqual(pyas.coalesce([(4, [3]), (0, [1, 2]), (2, [])]), [(0, bytearray([1, 2])), (4, bytearray([3]))])
+        self.assertEqual(pyas.coalesce([(2, [3]), (0, [1, 2])]), [(0, bytearray([1, 2, 3]))])
+    def test_overlap(self):
+        with self.assertRaises(pyas.Error):
+            pyas.coalesce([(0, [1, 2]), (1, [3])])
+    def test_image(self):
+        self.assertEqual(pyas.make_image([(0x802, [1]), (0x804, [2, 3])], 0x800, fill=0xff), bytearray([0xff, 0xff, 1, 0xff, 2, 3]))
+        self.assertEqual(pyas.make_image([(0x800, [1])], 0x800, 3), bytearray([1, 0, 0]))
+    def test_outside(self):
+        with self.assertRaises(pyas.Error):
+            pyas.make_image([(0x7ff, [1])], 0x800)
+        with self.assertRaises(pyas.Error):
+            pyas.make_image([(0x800, [1, 2])], 0x800, 1)
+    def test_delta(self):
+        self.assertEqual(pyas.image_delta(b"\x01\x02\x03\x04", b"\x01\x09\x09\x04\x05", 0x800), [(0x801, [9, 9]), (0x804, [5])])
+    def test_delta_truncated(self):
+        with self.assertRaises(pyas.Error):
+            pyas.image_delta(b"\x01\x02", b"\x01")
+
 if __name__ == "__main__":
     unittest.main()
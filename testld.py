@@ -0,0 +1,83 @@
+import unittest
+
+import pyas
+import pyld
+
+def obj(lines):
+    pyas.reset()
+    pyas.assemble_lines(lines)
+    return pyas.emitter.getobject()
+
+class TestObject(unittest.TestCase):
+    def test_local_reloc(self):
+        o = obj(["seg code", "start: jmp start"])
+        self.assertEqual(o["segments"], [{"name": "code", "org": None, "bytes": [0x4c, 0, 0],
+            "relocs": [{"offset": 1, "kind": "word", "segment": "code", "addend": 0}]}])
+    def test_branch_within_segment(self):
+        o = obj(["seg code", "loop: dex", "bne loop"])
+        self.assertEqual(o["segments"][0]["bytes"], [0xca, 0xd0, 0xfd])
+        self.assertEqual(o["segments"][0]["relocs"], [])
+    def test_import_export(self):
+        o = obj(["import putc", "export main", "seg code", "nop", "main: jsr putc+1"])
+        self.assertEqual(o["imports"], ["putc"])
+        self.assertEqual(o["exports"], {"main": ["code", 1]})
+        self.assertEqual(o["segments"][0]["relocs"], [{"offset": 2, "kind": "word", "symbol": "putc", "addend": 1}])
+    def test_no_zero_page_for_relocatable(self):
+        o = obj(["seg data", "var: dat 1", "seg code", "lda var"])
+        self.assertEqual(o["segments"][1]["bytes"], [0xad, 0, 0])
+    def test_branch_to_absolute(self):
+        o = obj(["seg code", "bne $1234"])
+        self.assertEqual(o["segments"][0]["relocs"], [{"offset": 1, "kind": "rel", "addend": 0x1234}])
+    def test_branch_to_absolute_label(self):
+        o = obj(["org $1000", "abs: nop", "seg code", "bne abs"])
+        self.assertEqual(o["segments"][1]["relocs"], [{"offset": 1, "kind": "rel", "addend": 0x1000}])
+    def test_getbytes_needs_link(self):
+        obj(["seg code", "nop"])
+        with self.assertRaises(pyas.Error):
+            pyas.emitter.getbytes()
+
+class TestLink(unittest.TestCase):
+    def test_link(self):
+        a = obj(["import putc", "seg code", "jsr putc", "rts"])
+        b = obj(["export putc", "seg code", "putc: sta $400", "rts", "seg data", "dat 2"])
+        self.assertEqual(pyld.link([a, b], {"code": 0x800}), [
+            (0x800, [0x20, 0x04, 0x08, 0x60, 0x8d, 0x00, 0x04, 0x60, 0, 0]),
+        ])
+    def test_sorted(self):
+        a = obj(["seg code", "nop", "seg data", "db 1"])
+        b = obj(["seg code", "rts"])
+        self.assertEqual(pyld.link([a, b], {"code": 0x800, "data": 0x900}), [
+            (0x800, [0xea, 0x60]),
+            (0x900, [1]),
+        ])
+    def test_absolute_section(self):
+        a = obj(["org $300", "lda #>msg", "ldx #<msg", "seg data", "msg: db 1,2"])
+        self.assertEqual(pyld.link([a], {"data": 0x1234}), [
+            (0x300, [0xa9, 0x34, 0xa2, 0x12]),
+            (0x1234, [1, 2]),
+        ])
+    def test_branch_to_absolute(self):
+        a = obj(["seg code", "bne $1234"])
+        self.assertEqual(pyld.link([a], {"code": 0x1200}), [(0x1200, [0xd0, 0x32])])
+    def test_branch_to_absolute_label(self):
+        a = obj(["org $1000", "abs: nop", "seg code", "bne abs"])
+        self.assertEqual(pyld.link([a], {"code": 0x1010}), [(0x1000, [0xea]), (0x1010, [0xd0, 0xee])])
+    def test_overlap(self):
+        a = obj(["seg code", "nop", "nop", "nop", "seg data", "db 1"])
+        with self.assertRaises(pyld.Error):
+            pyld.link([a], {"code": 0x800, "data": 0x802})
+    def test_overlap_org(self):
+        a = obj(["org $801", "nop", "seg code", "nop", "nop"])
+        with self.assertRaises(pyld.Error):
+            pyld.link([a], {"code": 0x800})
+    def test_unresolved(self):
+        a = obj(["import putc", "seg code", "jsr putc"])
+        with self.assertRaises(pyld.Error):
+            pyld.link([a])
+    def test_duplicate(self):
+        a = obj(["export f", "seg code", "f: rts"])
+        with self.assertRaises(pyld.Error):
+            pyld.link([a, a])
+
+if __name__ == "__main__":
+    unittest.main()